@@ -15,14 +15,25 @@ import os
 import re
 import json
 import time
+import queue
+import asyncio
 import argparse
+import threading
+from collections import deque
+from dataclasses import dataclass
 
 # --- Third-Party Libraries ---
+import httpx
+import diskcache
+import numpy as np
 import pandas as pd
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from fuzzywuzzy import fuzz
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from numba import njit
+from rapidfuzz import fuzz, process, utils
+from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
+from tqdm import tqdm
 
 # --- User Configuration ---
 # IMPORTANT: Paste your Spotify API credentials directly here.
@@ -30,162 +41,532 @@ from openpyxl.utils import get_column_letter
 CLIENT_ID = "YOUR_CLIENT_ID_HERE"
 SECRET_KEY = "YOUR_CLIENT_SECRET_HERE"
 
+# --- Spotify Web API Settings ---
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+SPOTIFY_SEARCH_URL = "https://api.spotify.com/v1/search"
+MAX_CONCURRENT_REQUESTS = 10  # Upper bound on in-flight search requests, to stay within Spotify's rate limits.
+MAX_CONNECTIONS = 32  # HTTP/2 multiplexes requests, so in practice a single pooled TLS connection carries them all.
+HTTP_TIMEOUT = 30  # Seconds.
+MAX_RETRIES = 5
+PERFECT_MATCH_MIN_CONFIDENCE = 90  # An exact artist + track match scoring at least this, and
+PERFECT_MATCH_MAX_DURATION_DIFF = 2  # within this duration difference (%), ends the search early.
+SEARCH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.spotify_cache')  # Search responses are reused across runs.
+
+# --- Excel Output Layout ---
+DETAILS_COLUMNS = [
+    'Local Artist', 'Local Track', 'Local Album', 'Match Found', 'Spotify Artist', 'Spotify Track', 'Spotify Album', 'Spotify Year', 'Final Score',
+    'artist_similarity_%', 'artist_score', 'reason_for_zero', 'track_similarity_%', 'track_name_score', 'artist_unmatched_words_penalty',
+    'track_unmatched_words_penalty', 'perfect_core_bonus', 'album_similarity_%', 'album_name_bonus', 'album_name_penalty', 'album_artist_bonus',
+    'album_artist_penalty', 'track_number_bonus', 'track_number_penalty', 'duration_diff_%', 'duration_penalty', 'year_difference', 'year_penalty',
+    'live_mismatch_penalty', 'final_score'
+]
+MAX_COLUMN_WIDTH = 60  # Keeps a few very long values from producing unreadably wide columns.
+DETAILS_WIDTH_SAMPLE_ROWS = 500  # Details rows buffered to size the columns before streaming the rest straight to disk.
+MAX_TRACKS_IN_FLIGHT = 64  # Tracks scheduled ahead of the one being written; bounds memory held by finished results.
+WRITER_QUEUE_SIZE = 64  # Finished tracks waiting for the Excel writer; matching pauses while the queue is full.
+
+# --- Precompiled Patterns ---
+_BRACKETS = re.compile(r'\[.*?\]')
+_PARENS = re.compile(r'\(.*?\)')
+_WS = re.compile(r'\s+')
+_ROMAN = re.compile(r'\b(?:V|IV|III|II|I)\b', re.IGNORECASE)
+_VA = 'various artists'
+
+# --- Spotify Client ---
+
+class SpotifyClient:
+    """Minimal async Spotify Web API client that caches a Client Credentials token and throttles searches."""
+
+    def __init__(self, http_client, cache=None, max_concurrent_requests=MAX_CONCURRENT_REQUESTS):
+        self.http_client, self.cache = http_client, cache
+        self.semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self._token, self._token_expires_at, self._token_lock = None, 0, asyncio.Lock()
+        self._resume_at = 0  # Shared back-off deadline set when Spotify answers with 429 Too Many Requests.
+
+    async def _get_token(self):
+        """Returns the cached bearer token, requesting a new one from /api/token when it is missing or about to expire."""
+        async with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires_at - 60:
+                response = await self.http_client.post(SPOTIFY_TOKEN_URL, data={'grant_type': 'client_credentials'}, auth=(CLIENT_ID, SECRET_KEY))
+                response.raise_for_status()
+                payload = response.json()
+                self._token, self._token_expires_at = payload['access_token'], time.monotonic() + payload['expires_in']
+        return self._token
+
+    async def search(self, query, limit=10):
+        """Runs a track search against /v1/search, backing off for 'Retry-After' seconds whenever Spotify rate-limits us."""
+        for attempt in range(MAX_RETRIES):
+            delay = self._resume_at - time.monotonic()
+            if delay > 0: await asyncio.sleep(delay)
+            token = await self._get_token()
+            async with self.semaphore:
+                params, headers = {'q': query, 'type': 'track', 'limit': limit}, {'Authorization': f"Bearer {token}"}
+                response = await self.http_client.get(SPOTIFY_SEARCH_URL, params=params, headers=headers)
+            if response.status_code == 429:
+                retry_after = int(response.headers.get('Retry-After', 1))
+                self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+                continue
+            if response.status_code == 401:
+                self._token = None
+                continue
+            response.raise_for_status()
+            return response.json()
+        raise RuntimeError(f"Giving up on query after {MAX_RETRIES} attempts (rate limited or unauthorized)")
+
 # --- Helper Functions ---
 
+def format_worksheet(worksheet, column_widths):
+    """Sets column widths (capped at MAX_COLUMN_WIDTH) and frozen panes on a write-only worksheet, before any rows are appended."""
+    for i, width in enumerate(column_widths):
+        worksheet.column_dimensions[get_column_letter(i + 1)].width = min(width, MAX_COLUMN_WIDTH) + 2
+    worksheet.freeze_panes = 'E2'
+
 def apply_formatting(worksheet, dataframe):
-    """Applies standard formatting to an openpyxl worksheet for better readability."""
+    """Applies standard formatting to a write-only openpyxl worksheet, sizing each column to the dataframe's content."""
     if dataframe.empty: return
-    for i, column_name in enumerate(dataframe.columns):
-        column_len = dataframe[column_name].astype(str).map(len).max()
-        header_len = len(str(column_name))
-        adjusted_width = max(column_len, header_len) + 2
-        worksheet.column_dimensions[get_column_letter(i + 1)].width = adjusted_width
-    worksheet.freeze_panes = 'E2'
-    worksheet.auto_filter.ref = worksheet.dimensions
+    column_widths = []
+    for column_name in dataframe.columns:
+        column_len = dataframe[column_name].astype(str).str.len().max()
+        column_widths.append(max(0 if pd.isna(column_len) else column_len, len(str(column_name))))
+    format_worksheet(worksheet, column_widths)
+    worksheet.auto_filter.ref = f"A1:{get_column_letter(len(dataframe.columns))}{len(dataframe) + 1}"
+
+def to_excel_value(value):
+    """Maps pandas missing values to None so openpyxl writes an empty cell instead of 'nan'."""
+    return None if pd.isna(value) else value
+
+@dataclass(frozen=True, slots=True)
+class ScoringConfig:
+    """The scoring weights, bonuses, penalties and thresholds from config.json, flattened for fast attribute access."""
+    confidence_threshold: float
+    artist_weight: float
+    track_name_weight: float
+    strong_album_match_bonus: float
+    perfect_core_match_bonus: float
+    album_artist_match_bonus: float
+    track_number_match_bonus: float
+    album_mismatch_penalty: float
+    duration_diff_medium_penalty: float
+    duration_diff_large_penalty: float
+    year_diff_medium_penalty: float
+    year_diff_large_penalty: float
+    live_mismatch_penalty: float
+    album_artist_mismatch_penalty: float
+    track_number_mismatch_penalty: float
+    unmatched_words_penalty: float
+    min_artist_similarity: float
+    numeric_thresholds: tuple  # (duration medium %, duration large %, year medium, year large), as read by _numeric_penalties.
 
 def load_config(config_path='config.json'):
-    """Loads the scoring logic and thresholds from an external JSON configuration file."""
+    """Loads the scoring logic and thresholds from an external JSON configuration file into a ScoringConfig."""
     print(f"Loading configuration from {config_path}...")
     with open(config_path, 'r') as f:
         config = json.load(f)
-    return config
+    weights, bonuses, penalties, rules = config['base_weights'], config['bonuses'], config['penalties'], config['rules']
+    return ScoringConfig(
+        confidence_threshold=config['confidence_threshold'], artist_weight=weights['artist'], track_name_weight=weights['track_name'],
+        strong_album_match_bonus=bonuses['strong_album_match'], perfect_core_match_bonus=bonuses.get('perfect_core_match', 0),
+        album_artist_match_bonus=bonuses['album_artist_match'], track_number_match_bonus=bonuses['track_number_match'],
+        album_mismatch_penalty=penalties['album_mismatch'], duration_diff_medium_penalty=penalties['duration_diff_medium'],
+        duration_diff_large_penalty=penalties['duration_diff_large'], year_diff_medium_penalty=penalties['year_diff_medium'],
+        year_diff_large_penalty=penalties['year_diff_large'], live_mismatch_penalty=penalties['live_mismatch'],
+        album_artist_mismatch_penalty=penalties['album_artist_mismatch'], track_number_mismatch_penalty=penalties['track_number_mismatch'],
+        unmatched_words_penalty=penalties['unmatched_words_penalty'], min_artist_similarity=rules['min_artist_similarity'],
+        numeric_thresholds=tuple(float(rules[key]) for key in ('duration_diff_medium_percent', 'duration_diff_large_percent', 'year_diff_medium_years', 'year_diff_large_years')))
 
-def setup_spotipy():
-    """Initializes and returns an authenticated Spotipy client instance."""
+def setup_spotify_client(http_client, cache=None):
+    """Validates the API credentials and returns a SpotifyClient bound to the given httpx client and optional search cache."""
     if not CLIENT_ID or not SECRET_KEY or CLIENT_ID == "YOUR_CLIENT_ID_HERE":
         raise ValueError("Spotify API credentials not set. Please edit the CLIENT_ID and SECRET_KEY constants at the top of the script.")
-    client_credentials_manager = SpotifyClientCredentials(client_id=CLIENT_ID, client_secret=SECRET_KEY)
-    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-    return sp
+    return SpotifyClient(http_client, cache)
+
+async def cached_search(client, query):
+    """Returns the Spotify search response for a query, reusing the on-disk cache so re-runs skip already-seen queries."""
+    if client.cache is None: return await client.search(query)
+    results = client.cache.get(query)
+    if results is None:
+        results = await client.search(query)
+        client.cache.set(query, results)
+    return results
 
 def clean_string(text):
     """Removes common extra info like "(Remastered)" or "[Instrumental]" for better matching."""
     if not isinstance(text, str): return ""
-    text = re.sub(r'\[.*?\]', '', text)
-    text = re.sub(r'\(.*?\)', '', text)
+    text = _BRACKETS.sub('', text)
+    text = _PARENS.sub('', text)
     return text.strip()
 
 def sanitize_for_search(text):
     """Cleans a string more aggressively for searching, removing roman numerals and versioning."""
     if not isinstance(text, str): return ""
     sanitized_text = clean_string(text)
-    roman_numerals = [r'\bV\b', r'\bIV\b', r'\bIII\b', r'\bII\b', r'\bI\b']
-    for pattern in roman_numerals:
-        sanitized_text = re.sub(pattern, '', sanitized_text, flags=re.IGNORECASE)
-    sanitized_text = re.sub(r'\s+', ' ', sanitized_text).strip()
+    sanitized_text = _ROMAN.sub('', sanitized_text)
+    sanitized_text = _WS.sub(' ', sanitized_text).strip()
     return sanitized_text
 
-def convert_duration_to_ms(duration_str):
-    """Converts a 'M:SS' or 'H:MM:SS' duration string to milliseconds."""
-    if not isinstance(duration_str, str): return 0
-    parts = list(map(int, str(duration_str).split(':')))
-    if len(parts) == 3: return (parts[0] * 3600 + parts[1] * 60 + parts[2]) * 1000
-    if len(parts) == 2: return (parts[0] * 60 + parts[1]) * 1000
-    return 0
+def batch_similarity(local_text, candidate_texts):
+    """Scores one local string against many candidates in a single vectorized RapidFuzz call (0-100 per candidate)."""
+    return process.cdist([local_text], candidate_texts, scorer=fuzz.token_set_ratio, processor=utils.default_process, dtype=np.uint8)[0]
+
+def read_tracks_csv(input_csv_path):
+    """Loads the input CSV with PyArrow's multithreaded reader into Arrow-backed columns.
+
+    Duration is forced to text (Arrow would otherwise read values like '10:21' as a time of day), and Year,
+    Track # and Disc # are coerced to nullable Int64 so a malformed cell only invalidates its own row. Fractional
+    values are truncated like int() would (1983.5 -> 1983) and infinities become missing.
+    """
+    convert_options = pa_csv.ConvertOptions(column_types={'Duration': pa.string()}, strings_can_be_null=True)
+    df = pa_csv.read_csv(input_csv_path, convert_options=convert_options).to_pandas(types_mapper=pd.ArrowDtype)
+    for col in ('Year', 'Track #', 'Disc #'):
+        if col not in df.columns: continue
+        numbers = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        df[col] = np.trunc(numbers.where(np.isfinite(numbers))).astype('Int64')
+    return df
+
+def to_int_or_missing(value):
+    """Converts a track/disc number to int, returning -1 when it is missing or not a valid integer."""
+    try: return int(value)
+    except (ValueError, TypeError): return -1
+
+def convert_durations_to_ms(durations):
+    """Converts a Series of 'M:SS' or 'H:MM:SS' duration strings to milliseconds in one vectorized pass.
+
+    Missing values or other shapes map to 0; strings with non-numeric parts map to NaN so the row can be reported as bad data.
+    """
+    parts = durations.astype('string').str.split(':', expand=True)
+    numbers = parts.apply(pd.to_numeric, errors='coerce').astype('float64')
+    is_invalid, part_count = (parts.notna() & numbers.isna()).any(axis=1), parts.notna().sum(axis=1)
+    numbers = numbers.reindex(columns=range(3))
+    h_mm_ss_ms = (numbers[0] * 3600 + numbers[1] * 60 + numbers[2]) * 1000
+    m_ss_ms = (numbers[0] * 60 + numbers[1]) * 1000
+    duration_ms = pd.Series(np.select([part_count == 3, part_count == 2], [h_mm_ss_ms, m_ss_ms], 0), index=durations.index)
+    return duration_ms.mask(is_invalid)
 
 # --- Core Logic ---
 
-def calculate_confidence(local_track, spotify_track, config):
-    """Calculates a confidence score (0-100) based on how well local and Spotify data match."""
-    breakdown = {}
-    local_clean_artist, spotify_clean_artist = clean_string(local_track['Artist']), clean_string(spotify_track['artist_name'])
-    local_clean_name, spotify_clean_name = clean_string(local_track['Name']), clean_string(spotify_track['track_name'])
+@dataclass(frozen=True)
+class LocalPrepped:
+    """A local track with its cleaned strings and parsed numbers computed once, rather than once per Spotify candidate."""
+    artist: str
+    name: str
+    album: str
+    album_artist: object
+    is_various_artists: bool
+    clean_artist: str
+    clean_name: str
+    clean_album: str
+    artist_tokens: frozenset
+    name_tokens: frozenset
+    is_live: bool
+    duration_ms: int
+    year: int
+    track_number: int  # -1 when missing or not a valid integer.
+    disc_number: int
+
+    @classmethod
+    def from_track(cls, local_track):
+        """Builds the prepared view of a local track dict as produced by process_track."""
+        clean_artist, clean_name = clean_string(local_track['Artist']), clean_string(local_track['Name'])
+        album_artist = local_track.get('Album Artist', local_track['Artist'])
+        return cls(
+            artist=local_track['Artist'], name=local_track['Name'], album=local_track['Album'], album_artist=album_artist, is_various_artists=_VA in str(album_artist).lower(),
+            clean_artist=clean_artist, clean_name=clean_name, clean_album=clean_string(local_track['Album']),
+            artist_tokens=frozenset(clean_artist.lower().split()), name_tokens=frozenset(clean_name.lower().split()),
+            is_live='live' in local_track['Name'].lower() or 'live' in local_track['Album'].lower(),
+            duration_ms=local_track['duration_ms'], year=local_track['Year'],
+            track_number=to_int_or_missing(local_track.get('Track #')), disc_number=to_int_or_missing(local_track.get('Disc #', 1)))
+
+@njit(cache=True)
+def _numeric_penalties(local_duration_ms, local_year, local_track_num, local_disc_num, spotify_durations_ms, spotify_years, spotify_track_nums, spotify_disc_nums, album_similarities, thresholds):
+    """Evaluates the duration, year and track-number rules for a batch of candidates in native code.
+
+    Missing track/disc numbers are encoded as -1. Returns the duration difference (%), the year difference and
+    a level per rule: 0 = no adjustment, 1 = medium penalty (or track-number bonus), 2 = large penalty (or track-number penalty).
+    """
+    count = spotify_durations_ms.shape[0]
+    duration_diff_percents, year_diffs = np.empty(count, np.float64), np.empty(count, np.int64)
+    track_number_levels, duration_levels, year_levels = np.zeros(count, np.int8), np.zeros(count, np.int8), np.zeros(count, np.int8)
+    for i in range(count):
+        if album_similarities[i] > 85 and local_track_num > 0 and local_disc_num >= 0 and spotify_disc_nums[i] >= 0:
+            if local_disc_num != spotify_disc_nums[i]: track_number_levels[i] = 2
+            elif spotify_track_nums[i] >= 0: track_number_levels[i] = 1 if local_track_num == spotify_track_nums[i] else 2
+
+        duration_diff_percents[i] = abs(local_duration_ms - spotify_durations_ms[i]) / local_duration_ms * 100 if local_duration_ms > 0 else 100.0
+        if duration_diff_percents[i] > thresholds[1]: duration_levels[i] = 2
+        elif duration_diff_percents[i] > thresholds[0]: duration_levels[i] = 1
+
+        year_diffs[i] = abs(local_year - spotify_years[i])
+        if year_diffs[i] > thresholds[3]: year_levels[i] = 2
+        elif year_diffs[i] > thresholds[2]: year_levels[i] = 1
+    return duration_diff_percents, year_diffs, track_number_levels, duration_levels, year_levels
 
-    artist_similarity = fuzz.token_set_ratio(local_clean_artist, spotify_clean_artist)
-    breakdown['artist_similarity_%'], breakdown['artist_score'] = artist_similarity, (artist_similarity / 100) * config['base_weights']['artist']
-    if artist_similarity < config['rules']['min_artist_similarity']:
-        breakdown['final_score'], breakdown['reason_for_zero'] = 0, f"Artist similarity {artist_similarity}% is below threshold {config['rules']['min_artist_similarity']}%"
+def calculate_confidence(local, spotify_track, config, artist_similarity, track_similarity=None, album_similarity=None, numeric_rules=None):
+    """Calculates a confidence score (0-100) based on how well local and Spotify data match.
+
+    Takes the precomputed token-set ratios and this candidate's row of `_numeric_penalties` output; everything
+    after the artist similarity is only needed for candidates that clear 'min_artist_similarity'.
+    """
+    breakdown, total_score = {}, 0.0
+    artist_similarity = int(artist_similarity)
+
+    breakdown['artist_similarity_%'], breakdown['artist_score'] = artist_similarity, (artist_similarity / 100) * config.artist_weight
+    total_score += breakdown['artist_score']
+    if artist_similarity < config.min_artist_similarity:
+        breakdown['final_score'], breakdown['reason_for_zero'] = 0, f"Artist similarity {artist_similarity}% is below threshold {config.min_artist_similarity}%"
         return 0, breakdown
 
-    track_similarity = fuzz.token_set_ratio(local_clean_name, spotify_clean_name)
-    breakdown['track_similarity_%'], breakdown['track_name_score'] = track_similarity, (track_similarity / 100) * config['base_weights']['track_name']
+    track_similarity, album_similarity = int(track_similarity), int(album_similarity)
+    duration_diff_percent, year_diff, track_number_level, duration_level, year_level = numeric_rules
+    breakdown['track_similarity_%'], breakdown['track_name_score'] = track_similarity, (track_similarity / 100) * config.track_name_weight
+    total_score += breakdown['track_name_score']
     
-    if artist_similarity == 100 and set(local_clean_artist.lower().split()) != set(spotify_clean_artist.lower().split()):
-        breakdown['artist_unmatched_words_penalty'] = config['penalties']['unmatched_words_penalty']
-    if track_similarity == 100 and set(local_clean_name.lower().split()) != set(spotify_clean_name.lower().split()):
-        breakdown['track_unmatched_words_penalty'] = config['penalties']['unmatched_words_penalty']
+    if artist_similarity == 100 and local.artist_tokens != frozenset(spotify_track['clean_artist_name'].lower().split()):
+        breakdown['artist_unmatched_words_penalty'] = points = config.unmatched_words_penalty; total_score += points
+    if track_similarity == 100 and local.name_tokens != frozenset(spotify_track['clean_track_name'].lower().split()):
+        breakdown['track_unmatched_words_penalty'] = points = config.unmatched_words_penalty; total_score += points
     if artist_similarity == 100 and track_similarity == 100:
-        breakdown['perfect_core_bonus'] = config['bonuses'].get('perfect_core_match', 0)
+        breakdown['perfect_core_bonus'] = points = config.perfect_core_match_bonus; total_score += points
 
-    album_similarity = fuzz.token_set_ratio(local_track['Album'], spotify_track['album_name'])
     breakdown['album_similarity_%'] = album_similarity
-    if album_similarity > 90: breakdown['album_name_bonus'] = config['bonuses']['strong_album_match']
-    elif album_similarity < 50: breakdown['album_name_penalty'] = config['penalties']['album_mismatch']
-
-    local_album_artist, spotify_album_artist = local_track.get('Album Artist', local_track['Artist']), spotify_track.get('album_artist_name', spotify_track['artist_name'])
-    is_local_va, is_spotify_va = 'various artists' in str(local_album_artist).lower(), 'various artists' in str(spotify_album_artist).lower()
-    if is_local_va and is_spotify_va: breakdown['album_artist_bonus'] = config['bonuses']['album_artist_match']
-    elif fuzz.ratio(local_album_artist, spotify_album_artist) > 90: breakdown['album_artist_bonus'] = config['bonuses']['album_artist_match']
-    elif is_local_va != is_spotify_va and artist_similarity < 100: breakdown['album_artist_penalty'] = config['penalties']['album_artist_mismatch']
-
-    if album_similarity > 85:
-        local_track_num, spotify_track_num = local_track.get('Track #'), spotify_track.get('track_number')
-        local_disc_num, spotify_disc_num = local_track.get('Disc #', 1), spotify_track.get('disc_number', 1)
-        try:
-            if local_track_num and pd.notna(local_track_num) and int(local_disc_num) == int(spotify_disc_num) and int(local_track_num) == int(spotify_track_num):
-                breakdown['track_number_bonus'] = config['bonuses']['track_number_match']
-            elif local_track_num and pd.notna(local_track_num):
-                breakdown['track_number_penalty'] = config['penalties']['track_number_mismatch']
-        except (ValueError, TypeError): pass
-
-    duration_diff = abs(local_track['duration_ms'] - spotify_track['duration_ms'])
-    duration_diff_percent = (duration_diff / local_track['duration_ms']) * 100 if local_track['duration_ms'] > 0 else 100
-    breakdown['duration_diff_%'] = round(duration_diff_percent, 2)
-    if duration_diff_percent > config['rules']['duration_diff_large_percent']: breakdown['duration_penalty'] = config['penalties']['duration_diff_large']
-    elif duration_diff_percent > config['rules']['duration_diff_medium_percent']: breakdown['duration_penalty'] = config['penalties']['duration_diff_medium']
-
-    year_diff = abs(local_track['Year'] - int(str(spotify_track['release_year'])[:4]))
-    breakdown['year_difference'] = year_diff
-    if year_diff > config['rules']['year_diff_large_years']: breakdown['year_penalty'] = config['penalties']['year_diff_large']
-    elif year_diff > config['rules']['year_diff_medium_years']: breakdown['year_penalty'] = config['penalties']['year_diff_medium']
-
-    local_is_live = 'live' in local_track['Name'].lower() or 'live' in local_track['Album'].lower()
+    if album_similarity > 90: breakdown['album_name_bonus'] = points = config.strong_album_match_bonus; total_score += points
+    elif album_similarity < 50: breakdown['album_name_penalty'] = points = config.album_mismatch_penalty; total_score += points
+
+    is_local_va, is_spotify_va = local.is_various_artists, spotify_track['is_various_artists']
+    if is_local_va and is_spotify_va: breakdown['album_artist_bonus'] = points = config.album_artist_match_bonus; total_score += points
+    elif round(fuzz.ratio(local.album_artist, spotify_track['album_artist_name'])) > 90: breakdown['album_artist_bonus'] = points = config.album_artist_match_bonus; total_score += points
+    elif is_local_va != is_spotify_va and artist_similarity < 100: breakdown['album_artist_penalty'] = points = config.album_artist_mismatch_penalty; total_score += points
+
+    if track_number_level == 1: breakdown['track_number_bonus'] = points = config.track_number_match_bonus; total_score += points
+    elif track_number_level == 2: breakdown['track_number_penalty'] = points = config.track_number_mismatch_penalty; total_score += points
+
+    breakdown['duration_diff_%'] = round(float(duration_diff_percent), 2)
+    if duration_level == 2: breakdown['duration_penalty'] = points = config.duration_diff_large_penalty; total_score += points
+    elif duration_level == 1: breakdown['duration_penalty'] = points = config.duration_diff_medium_penalty; total_score += points
+
+    breakdown['year_difference'] = int(year_diff)
+    if year_level == 2: breakdown['year_penalty'] = points = config.year_diff_large_penalty; total_score += points
+    elif year_level == 1: breakdown['year_penalty'] = points = config.year_diff_medium_penalty; total_score += points
+
     spotify_is_live = 'live' in spotify_track['track_name'].lower() or 'live' in spotify_track['album_name'].lower()
-    if local_is_live != spotify_is_live: breakdown['live_mismatch_penalty'] = config['penalties']['live_mismatch']
+    if local.is_live != spotify_is_live: breakdown['live_mismatch_penalty'] = points = config.live_mismatch_penalty; total_score += points
 
-    total_score = sum(v for k, v in breakdown.items() if 'score' in k or 'penalty' in k or 'bonus' in k)
     final_score = max(0, min(100, int(total_score)))
     breakdown['final_score'] = final_score
     return final_score, breakdown
 
-def search_for_track(sp, local_track, config):
-    """Performs a series of searches on Spotify to find all possible candidates for a track."""
-    best_match, highest_confidence, detailed_logs = (None, 0, [])
-    clean_artist_name = clean_string(local_track['Artist'])
-    original_clean_track_name, sanitized_for_search_name = clean_string(local_track['Name']), sanitize_for_search(local_track['Name'])
+def score_candidates(local, candidates, config):
+    """Scores a batch of Spotify candidates for one local track, returning a (confidence, breakdown) pair per candidate.
+
+    Similarities and numeric rules are computed in vectorized batches. Candidates below 'min_artist_similarity'
+    are rejected on the artist score alone, so the track/album and numeric work only runs for the rest.
+    """
+    artist_similarities = batch_similarity(local.clean_artist, [c['clean_artist_name'] for c in candidates])
+    viable = [i for i, similarity in enumerate(artist_similarities) if similarity >= config.min_artist_similarity]
+    scores = {}
+    if viable:
+        viable_candidates = [candidates[i] for i in viable]
+        track_similarities = batch_similarity(local.clean_name, [c['clean_track_name'] for c in viable_candidates])
+        album_similarities = batch_similarity(local.album, [c['album_name'] for c in viable_candidates])
+        numeric_rules = _numeric_penalties(
+            local.duration_ms, local.year, local.track_number, local.disc_number,
+            np.array([c['duration_ms'] for c in viable_candidates], dtype=np.float64), np.array([c['release_year_int'] for c in viable_candidates], dtype=np.int64),
+            np.array([to_int_or_missing(c['track_number']) for c in viable_candidates], dtype=np.int64), np.array([to_int_or_missing(c['disc_number']) for c in viable_candidates], dtype=np.int64),
+            album_similarities, config.numeric_thresholds)
+        for i, track_similarity, album_similarity, *candidate_rules in zip(viable, track_similarities, album_similarities, *numeric_rules):
+            scores[i] = (track_similarity, album_similarity, candidate_rules)
+    return [calculate_confidence(local, spotify_track, config, artist_similarity, *scores.get(i, ()))
+            for i, (spotify_track, artist_similarity) in enumerate(zip(candidates, artist_similarities))]
+
+def parse_spotify_item(item):
+    """Flattens a Spotify track object into the candidate dict used for scoring, with its cleaned fields computed once."""
+    artist_name, album_artist_name = ', '.join(a['name'] for a in item['artists']), ', '.join(a['name'] for a in item['album']['artists'])
+    return {
+        'track_name': item['name'], 'artist_name': artist_name, 'album_name': item['album']['name'], 'album_artist_name': album_artist_name,
+        'clean_track_name': clean_string(item['name']), 'clean_artist_name': clean_string(artist_name), 'is_various_artists': _VA in album_artist_name.lower(),
+        'release_year_int': int(item['album']['release_date'][:4]), 'duration_ms': item['duration_ms'], 'id': item['id'], 'url': item['external_urls']['spotify'],
+        'track_number': item.get('track_number'), 'disc_number': item.get('disc_number')
+    }
+
+def is_perfect_core_match(breakdown):
+    """True when a candidate's artist and track names match exactly and its duration is within PERFECT_MATCH_MAX_DURATION_DIFF %."""
+    return breakdown.get('artist_similarity_%') == 100 and breakdown.get('track_similarity_%') == 100 and breakdown.get('duration_diff_%', 100) < PERFECT_MATCH_MAX_DURATION_DIFF
+
+async def search_for_track(client, local_track, config):
+    """Runs a series of increasingly general searches on Spotify, stopping as soon as a convincing match is found."""
+    best_match, highest_confidence, detailed_logs, best_breakdown = (None, 0, [], {})
+    local = LocalPrepped.from_track(local_track)
+    sanitized_for_search_name = sanitize_for_search(local.name)
     search_queries = [
-        f"track:\"{original_clean_track_name}\" artist:\"{clean_artist_name}\" album:\"{clean_string(local_track['Album'])}\"",
-        f"track:\"{original_clean_track_name}\" artist:\"{clean_artist_name}\" year:{local_track['Year']}",
-        f"track:\"{sanitized_for_search_name}\" artist:\"{clean_artist_name}\"",
-        f"track:\"{original_clean_track_name}\" artist:\"{clean_artist_name}\"",
-        f"{local_track['Name']} {local_track['Artist']}"
+        f"track:\"{local.clean_name}\" artist:\"{local.clean_artist}\" album:\"{local.clean_album}\"",
+        f"track:\"{local.clean_name}\" artist:\"{local.clean_artist}\" year:{local.year}",
+        f"track:\"{sanitized_for_search_name}\" artist:\"{local.clean_artist}\"",
+        f"track:\"{local.clean_name}\" artist:\"{local.clean_artist}\"",
+        f"{local.name} {local.artist}"
     ]
     processed_spotify_ids = set()
+    # Queries run one at a time (tracks still run concurrently): most tracks match on the first, specific query,
+    # so escalating only when needed saves requests and rate-limit budget.
     for query in search_queries:
         try:
-            results = sp.search(q=query, type='track', limit=10)
+            results = await cached_search(client, query)
             if not results or not results['tracks']['items']: continue
+            candidates = []
             for item in results['tracks']['items']:
                 if item['id'] in processed_spotify_ids: continue
                 processed_spotify_ids.add(item['id'])
-                spotify_track = {'track_name': item['name'], 'artist_name': ', '.join(a['name'] for a in item['artists']), 'album_name': item['album']['name'], 'album_artist_name': ', '.join(a['name'] for a in item['album']['artists']), 'release_year': item['album']['release_date'], 'duration_ms': item['duration_ms'], 'id': item['id'], 'url': item['external_urls']['spotify'], 'track_number': item.get('track_number'), 'disc_number': item.get('disc_number')}
-                confidence, breakdown = calculate_confidence(local_track, spotify_track, config)
-                log_entry = {'Local Artist': local_track['Artist'], 'Local Track': local_track['Name'], 'Local Album': local_track['Album'], 'Spotify Artist': spotify_track['artist_name'], 'Spotify Track': spotify_track['track_name'], 'Spotify Album': spotify_track['album_name'], 'Spotify Year': str(spotify_track['release_year'])[:4], 'Final Score': breakdown.get('final_score', 0), **breakdown}
+                candidates.append(parse_spotify_item(item))
+            if not candidates: continue
+            for spotify_track, (confidence, breakdown) in zip(candidates, score_candidates(local, candidates, config)):
+                log_entry = {'Local Artist': local.artist, 'Local Track': local.name, 'Local Album': local.album, 'Spotify Artist': spotify_track['artist_name'], 'Spotify Track': spotify_track['track_name'], 'Spotify Album': spotify_track['album_name'], 'Spotify Year': str(spotify_track['release_year_int']), 'Final Score': breakdown.get('final_score', 0), **breakdown}
                 detailed_logs.append(log_entry)
-                if confidence > highest_confidence: highest_confidence, best_match = confidence, spotify_track
+                if confidence > highest_confidence: highest_confidence, best_match, best_breakdown = confidence, spotify_track, breakdown
             if highest_confidence > 95: break
+            if highest_confidence >= PERFECT_MATCH_MIN_CONFIDENCE and is_perfect_core_match(best_breakdown): break
         except Exception as e:
-            print(f"An error occurred during search for query '{query}': {e}")
-            time.sleep(2)
+            tqdm.write(f"An error occurred during search for query '{query}': {e}")
     return best_match, highest_confidence, detailed_logs
 
+# --- Excel Output ---
+
+class ExcelReportWriter:
+    """Streams the Summary and Details sheets into a write-only openpyxl workbook as tracks finish processing.
+
+    Details rows go straight to disk once the first DETAILS_WIDTH_SAMPLE_ROWS have sized the columns; columns whose
+    widths are already known from the input (`known_widths`) are sized over every row. Only the one-row-per-track
+    summary is kept in memory, because it is sorted by album artist before being written.
+    """
+
+    def __init__(self, output_excel_path, known_widths=None):
+        self.output_excel_path = output_excel_path
+        self.workbook = Workbook(write_only=True)
+        self.summary_sheet, self.details_sheet = self.workbook.create_sheet('Summary'), None
+        self.summary_rows, self._pending_details, self._details_row_count = [], [], 0
+        self._details_widths = [max(len(column_name), (known_widths or {}).get(column_name, 0)) for column_name in DETAILS_COLUMNS]
+
+    def add_track(self, summary_row, detailed_logs):
+        """Records one track's summary row and appends its candidate logs, best score first."""
+        self.summary_rows.append(summary_row)
+        for log in sorted(detailed_logs, key=lambda log: log['Final Score'], reverse=True):
+            row = [to_excel_value(log.get(column_name)) for column_name in DETAILS_COLUMNS]
+            self._details_row_count += 1
+            if self.details_sheet is not None:
+                self.details_sheet.append(row)
+                continue
+            for i, value in enumerate(row):
+                if value is not None: self._details_widths[i] = max(self._details_widths[i], len(str(value)))
+            self._pending_details.append(row)
+            if len(self._pending_details) >= DETAILS_WIDTH_SAMPLE_ROWS: self._start_details_sheet()
+
+    def _start_details_sheet(self):
+        """Creates the Details sheet, sized from the buffered sample, and flushes the buffered rows into it."""
+        self.details_sheet = self.workbook.create_sheet('Details')
+        format_worksheet(self.details_sheet, self._details_widths)
+        self.details_sheet.append(DETAILS_COLUMNS)
+        for row in self._pending_details: self.details_sheet.append(row)
+        self._pending_details = []
+
+    def close(self):
+        """Writes the sorted Summary sheet and saves the workbook."""
+        if self._pending_details: self._start_details_sheet()
+        if self.details_sheet is not None:
+            self.details_sheet.auto_filter.ref = f"A1:{get_column_letter(len(DETAILS_COLUMNS))}{self._details_row_count + 1}"
+
+        summary_df = pd.DataFrame(self.summary_rows)
+        if summary_df.empty:
+            self.workbook.save(self.output_excel_path)
+            return
+        summary_df = summary_df.sort_values(by='Album Artist', ascending=True, na_position='first')
+        
+        # <<< MODIFICATION START >>>
+        # Reorder the summary columns to place 'Include in Playlist' after 'Found on Spotify'
+        summary_cols = summary_df.columns.tolist()
+        if 'Found on Spotify' in summary_cols:
+            # Move 'Include in Playlist' to the correct position
+            if 'Include in Playlist' in summary_cols:
+                summary_cols.remove('Include in Playlist')
+            insert_pos = summary_cols.index('Found on Spotify') + 1
+            summary_cols.insert(insert_pos, 'Include in Playlist')
+            summary_df = summary_df[summary_cols]
+        # <<< MODIFICATION END >>>
+
+        print("Applying formatting to Summary sheet...")
+        apply_formatting(self.summary_sheet, summary_df)
+        self.summary_sheet.append(summary_df.columns.tolist())
+        for row in summary_df.itertuples(index=False, name=None):
+            self.summary_sheet.append([to_excel_value(value) for value in row])
+        self.workbook.save(self.output_excel_path)
+
+def local_details_widths(df):
+    """Measures the Local Artist/Track/Album Details columns up front from the input CSV, before any rows are streamed."""
+    widths = {}
+    for details_col, csv_col in (('Local Artist', 'Artist'), ('Local Track', 'Name'), ('Local Album', 'Album')):
+        lengths = df[csv_col].astype('string').str.len().fillna(0)
+        widths[details_col] = 0 if lengths.empty else int(lengths.max())
+    return widths
+
+def excel_writer_thread(results_queue, output_excel_path, failures, aborted, known_widths=None):
+    """Writes (summary_row, detailed_logs) tuples from the queue until the None sentinel arrives, then saves the workbook.
+
+    Runs on a background thread so the Excel work overlaps with the Spotify searches; any error is appended to `failures`.
+    Once `aborted` is set the thread stops without saving, so an interrupted run never overwrites an earlier report.
+    """
+    try:
+        report = ExcelReportWriter(output_excel_path, known_widths)
+        while True:
+            track_result = results_queue.get()
+            if aborted.is_set(): return
+            if track_result is None: break
+            report.add_track(*track_result)
+        report.close()
+    except Exception as e:
+        failures.append(e)
+
+async def hand_to_writer(results_queue, track_result, writer, failures):
+    """Queues a track result for the Excel writer, waiting for room without blocking the event loop.
+
+    Raises the writer's error as soon as it fails, so the run stops instead of matching tracks nobody will write.
+    """
+    while True:
+        if failures: raise failures[0]
+        if not writer.is_alive(): raise RuntimeError("Excel writer thread stopped unexpectedly.")
+        try:
+            # Block in a worker thread, timing out now and then to re-check that the writer is still there to drain the queue.
+            await asyncio.to_thread(results_queue.put, track_result, timeout=1)
+            return
+        except queue.Full:
+            continue
+
 # --- Main Execution Block ---
 
-def main(input_csv_path, output_excel_path):
+async def process_track(client, index, row, duration_ms, total_rows, config):
+    """Searches Spotify for a single CSV record and returns its summary row together with the candidate logs."""
+    summary_row, detailed_logs = dict(row), []
+    try:
+        if pd.isna(row['Year']): raise ValueError("Year is missing")
+        if pd.isna(duration_ms): raise ValueError(f"Duration '{row['Duration']}' is not in M:SS or H:MM:SS format")
+        local_track = {**row, 'Year': int(row['Year']), 'duration_ms': int(duration_ms)}
+        best_match, confidence, detailed_logs = await search_for_track(client, local_track, config)
+        final_match_found = bool(best_match and confidence >= config.confidence_threshold)
+        for log in detailed_logs: log['Match Found'] = final_match_found
+        
+        # <<< MODIFICATION START >>>
+        if final_match_found:
+            tqdm.write(f"✅ {index + 1}/{total_rows} {row['Artist']} - {row['Name']}: Found Match '{best_match['track_name']}' with confidence: {confidence}%")
+            summary_row.update({'Found on Spotify': True, 'Include in Playlist': True, 'Confidence': f"{confidence}%", 'Spotify Track ID': best_match['id'], 'Spotify Name': best_match['track_name'], 'Spotify Artist': best_match['artist_name'], 'Spotify Album': best_match['album_name'], 'Spotify URL': best_match['url']})
+        else:
+            tqdm.write(f"❌ {index + 1}/{total_rows} {row['Artist']} - {row['Name']}: No suitable match found. Highest confidence: {confidence}%")
+            summary_row.update({'Found on Spotify': False, 'Include in Playlist': False, 'Confidence': f"{confidence}% (Below Threshold)", 'Spotify Track ID': '', 'Spotify Name': '', 'Spotify Artist': '', 'Spotify Album': '', 'Spotify URL': ''})
+        # <<< MODIFICATION END >>>
+    except Exception as e:
+        tqdm.write(f"\n--- ERROR Processing {index + 1}/{total_rows}: {row.get('Artist', 'N/A')} - {row.get('Name', 'N/A')} ---")
+        tqdm.write(f"   Could not process row due to bad data: {e}. Marking as not found.")
+        summary_row.update({'Found on Spotify': False, 'Include in Playlist': False, 'Confidence': "Error", 'Spotify Track ID': '', 'Spotify Name': '', 'Spotify Artist': '', 'Spotify Album': '', 'Spotify URL': ''})
+    return summary_row, detailed_logs
+
+async def main(input_csv_path, output_excel_path, use_cache=True):
     """Main function to orchestrate the entire process."""
     config = load_config()
-    sp = setup_spotipy()
-    df = pd.read_csv(input_csv_path)
+    df = read_tracks_csv(input_csv_path)
     
     required_cols = ['Artist', 'Name', 'Album', 'Year', 'Duration']
     optional_cols = ['Album Artist', 'Track #', 'Disc #']
@@ -194,81 +575,60 @@ def main(input_csv_path, output_excel_path):
     for col in optional_cols:
         if col not in df.columns: df[col] = None
     
-    summary_results, all_detailed_logs, total_rows = [], [], len(df)
+    # Process tracks in artist/track order so the streamed Details sheet comes out sorted; the index keeps each row's CSV position for messages.
+    df = df.sort_values(by=['Artist', 'Name'], kind='stable')
+    total_rows, durations_ms = len(df), convert_durations_to_ms(df['Duration'])
     print(f"\nStarting to process {total_rows} tracks...")
     
-    for index, row in df.iterrows():
-        summary_row = row.to_dict()
-        try:
-            if pd.isna(row['Year']): raise ValueError("Year is missing")
-            local_track = {'Artist': row['Artist'], 'Name': row['Name'], 'Album': row['Album'], 'Album Artist': row['Album Artist'], 'Year': int(row['Year']), 'Duration': row['Duration'], 'duration_ms': convert_duration_to_ms(row['Duration']), 'Track #': row['Track #'], 'Disc #': row['Disc #']}
-            print(f"\n--- Processing {index + 1}/{total_rows}: {row['Artist']} - {row['Name']} ---")
-            best_match, confidence, detailed_logs = search_for_track(sp, local_track, config)
-            final_match_found = bool(best_match and confidence >= config['confidence_threshold'])
-            for log in detailed_logs: log['Match Found'] = final_match_found
-            all_detailed_logs.extend(detailed_logs)
-            
-            # <<< MODIFICATION START >>>
-            if final_match_found:
-                print(f"✅ Found Match: '{best_match['track_name']}' with confidence: {confidence}%")
-                summary_row.update({'Found on Spotify': True, 'Include in Playlist': True, 'Confidence': f"{confidence}%", 'Spotify Track ID': best_match['id'], 'Spotify Name': best_match['track_name'], 'Spotify Artist': best_match['artist_name'], 'Spotify Album': best_match['album_name'], 'Spotify URL': best_match['url']})
+    results_queue, writer_failures, writer_aborted, completed = queue.Queue(maxsize=WRITER_QUEUE_SIZE), [], threading.Event(), False
+    writer = threading.Thread(target=excel_writer_thread, args=(results_queue, output_excel_path, writer_failures, writer_aborted, local_details_widths(df)), name='excel-writer')
+    cache = diskcache.Cache(SEARCH_CACHE_DIR) if use_cache else None
+    try:
+        async with httpx.AsyncClient(http2=True, limits=httpx.Limits(max_connections=MAX_CONNECTIONS), timeout=HTTP_TIMEOUT) as http_client:
+            client = setup_spotify_client(http_client, cache)
+            writer.start()
+            pending = zip(df.index, df.to_dict(orient='records'), durations_ms)
+            tasks = deque()
+            with tqdm(total=total_rows, desc="Matching tracks", unit="track") as progress:
+                def schedule_next():
+                    for index, row, duration_ms in pending:
+                        task = asyncio.ensure_future(process_track(client, index, row, duration_ms, total_rows, config))
+                        task.add_done_callback(lambda _: progress.update())
+                        tasks.append(task)
+                        return
+                for _ in range(MAX_TRACKS_IN_FLIGHT): schedule_next()
+                # Results are handed to the writer in task order (to keep the Details sheet sorted), so a slow track holds back
+                # the ones after it. Each task is dropped as it is consumed, and only a window of tracks is scheduled ahead, so
+                # finished logs never pile up while the writer (whose queue is bounded too) catches up.
+                try:
+                    while tasks:
+                        track_result = await tasks.popleft()
+                        schedule_next()
+                        await hand_to_writer(results_queue, track_result, writer, writer_failures)
+                finally:
+                    for task in tasks: task.cancel()
+        completed = True
+        print("\nProcessing complete. Saving Excel file with two sheets...")
+    finally:
+        if cache is not None: cache.close()
+        if writer.is_alive():
+            if completed: results_queue.put(None)
             else:
-                print(f"❌ No suitable match found. Highest confidence: {confidence}%")
-                summary_row.update({'Found on Spotify': False, 'Include in Playlist': False, 'Confidence': f"{confidence}% (Below Threshold)", 'Spotify Track ID': '', 'Spotify Name': '', 'Spotify Artist': '', 'Spotify Album': '', 'Spotify URL': ''})
-            # <<< MODIFICATION END >>>
-        except Exception as e:
-            print(f"\n--- ERROR Processing {index + 1}/{total_rows}: {row.get('Artist', 'N/A')} - {row.get('Name', 'N/A')} ---")
-            print(f"   Could not process row due to bad data: {e}. Marking as not found.")
-            summary_row.update({'Found on Spotify': False, 'Include in Playlist': False, 'Confidence': "Error", 'Spotify Track ID': '', 'Spotify Name': '', 'Spotify Artist': '', 'Spotify Album': '', 'Spotify URL': ''})
-        
-        summary_results.append(summary_row)
+                # Stop without saving. The sentinel only wakes a writer idling on an empty queue; a full one is still draining and sees the flag.
+                writer_aborted.set()
+                try: results_queue.put_nowait(None)
+                except queue.Full: pass
+            writer.join()
 
-    print("\nProcessing complete. Creating Excel file with two sheets...")
-    summary_df = pd.DataFrame(summary_results)
-    detailed_df = pd.DataFrame(all_detailed_logs)
-    
-    # Sort the DataFrames before writing to Excel
-    summary_df = summary_df.sort_values(by='Album Artist', ascending=True, na_position='first')
-    
-    # <<< MODIFICATION START >>>
-    # Reorder the summary columns to place 'Include in Playlist' after 'Found on Spotify'
-    summary_cols = summary_df.columns.tolist()
-    if 'Found on Spotify' in summary_cols:
-        # Move 'Include in Playlist' to the correct position
-        if 'Include in Playlist' in summary_cols:
-            summary_cols.remove('Include in Playlist')
-        insert_pos = summary_cols.index('Found on Spotify') + 1
-        summary_cols.insert(insert_pos, 'Include in Playlist')
-        summary_df = summary_df[summary_cols]
-    # <<< MODIFICATION END >>>
-
-    if not detailed_df.empty:
-        first_cols = ['Local Artist', 'Local Track', 'Local Album', 'Match Found', 'Spotify Artist', 'Spotify Track', 'Spotify Album', 'Spotify Year', 'Final Score']
-        other_cols = [col for col in detailed_df.columns if col not in first_cols]
-        detailed_df = detailed_df[first_cols + other_cols]
-        detailed_df = detailed_df.sort_values(by=['Local Artist', 'Local Track', 'Final Score'], ascending=[True, True, False])
-
-    with pd.ExcelWriter(output_excel_path, engine='openpyxl') as writer:
-        summary_df.to_excel(writer, sheet_name='Summary', index=False)
-        if not detailed_df.empty:
-            detailed_df.to_excel(writer, sheet_name='Details', index=False)
-        
-        summary_sheet = writer.sheets['Summary']
-        print("Applying formatting to Summary sheet...")
-        apply_formatting(summary_sheet, summary_df)
-        
-        if 'Details' in writer.sheets and not detailed_df.empty:
-            details_sheet = writer.sheets['Details']
-            print("Applying formatting to Details sheet...")
-            apply_formatting(details_sheet, detailed_df)
-        
+    if writer_failures: raise writer_failures[0]
     print(f"✨ Success! Output saved to {output_excel_path}")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Finds Spotify tracks that match a local music collection CSV.", formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-input_csv', required=True, metavar='INPUT_PATH', help="Path to the input CSV file. The .csv extension is optional.")
     parser.add_argument('-output_excel', required=True, metavar='OUTPUT_NAME', help="Name for the output Excel file. The .xlsx extension is optional.")
+    parser.add_argument('-no_cache', '--no-cache', dest='no_cache', action='store_true', help="Always query Spotify instead of reusing responses cached by previous runs.")
     args = parser.parse_args()
     input_file = args.input_csv if args.input_csv.lower().endswith('.csv') else args.input_csv + '.csv'
     output_file = args.output_excel if args.output_excel.lower().endswith('.xlsx') else args.output_excel + '.xlsx'
-    main(input_file, output_file)
\ No newline at end of file
+    asyncio.run(main(input_file, output_file, use_cache=not args.no_cache))
\ No newline at end of file